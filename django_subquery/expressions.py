@@ -1,7 +1,32 @@
+from collections import deque
+from functools import partial
+
 from django.db.models.expressions import Expression, F
 from django.db.models import fields
 
 
+_MISSING = object()
+
+_OUTER_REF_ERROR_MSG = (
+    'This queryset contains a reference to an outer query and may '
+    'only be used in a subquery.'
+)
+
+
+def _resolve(child, add_external_alias, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+    resolve_expression = getattr(child, 'resolve_expression', None)
+    if resolve_expression is None:
+        return child
+    resolved = resolve_expression(
+        query=query, allow_joins=allow_joins, reuse=reuse,
+        summarize=summarize, for_save=for_save,
+    )
+    alias = getattr(resolved, 'alias', _MISSING)
+    if alias is not _MISSING and alias != resolved.target.model._meta.db_table:
+        add_external_alias(alias)
+    return resolved
+
+
 class ResolvedOuterRef(F):
     """
     An object that contains a reference to an outer query.
@@ -10,10 +35,7 @@ class ResolvedOuterRef(F):
     the inner query has been used as a subquery.
     """
     def as_sql(self, *args, **kwargs):
-        raise ValueError(
-            'This queryset contains a reference to an outer query and may '
-            'only be used in a subquery.'
-        )
+        raise ValueError(_OUTER_REF_ERROR_MSG)
 
     def _prepare(self, output_field=None):
         return self
@@ -39,68 +61,104 @@ class Subquery(Expression):
     def __init__(self, queryset, output_field=None, **extra):
         self.queryset = queryset
         self.extra = extra
-        if output_field is None and len(self.queryset.query.select) == 1:
-            output_field = self.queryset.query.select[0].field
+        self._compiled_cache = None
+        self._source_expr_cache = None
+        if output_field is None:
+            select = queryset.query.select
+            if len(select) == 1:
+                output_field = select[0].field
         super(Subquery, self).__init__(output_field)
 
     def copy(self):
         clone = super(Subquery, self).copy()
         clone.queryset = clone.queryset.all()
+        clone._compiled_cache = None
+        clone._source_expr_cache = None
         return clone
 
     def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
         clone = self.copy()
         clone.is_summary = summarize
-        clone.queryset.query.bump_prefix(query)
-
-        # Need to recursively resolve these.
-        def resolve_all(child):
-            if hasattr(child, 'children'):
-                [resolve_all(_child) for _child in child.children]
-            if hasattr(child, 'rhs'):
-                child.rhs = resolve(child.rhs)
-
-        def resolve(child):
-            if hasattr(child, 'resolve_expression'):
-                resolved = child.resolve_expression(
-                    query=query, allow_joins=allow_joins, reuse=reuse,
-                    summarize=summarize, for_save=for_save,
-                )
-                if hasattr(resolved, 'alias') and resolved.alias != resolved.target.model._meta.db_table:
-                    clone.queryset.query.external_aliases.add(resolved.alias)
-                return resolved
-            return child
-
-        resolve_all(clone.queryset.query.where)
-
-        for key, value in clone.queryset.query.annotations.items():
-            if isinstance(value, Subquery):
-                clone.queryset.query.annotations[key] = resolve(value)
+        clone_query = clone.queryset.query
+        clone_query.bump_prefix(query)
+
+        # Collect the external aliases and add them to the query in one go.
+        external_aliases = []
+        resolve = partial(
+            _resolve, add_external_alias=external_aliases.append,
+            query=query, allow_joins=allow_joins, reuse=reuse,
+            summarize=summarize, for_save=for_save,
+        )
 
+        # Need to resolve the whole where tree: walk it with an explicit stack
+        # rather than recursing.
+        stack = deque(clone_query.where.children)
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            node = pop()
+            children = getattr(node, 'children', _MISSING)
+            if children is not _MISSING:
+                extend(children)
+            rhs = getattr(node, 'rhs', _MISSING)
+            if rhs is not _MISSING:
+                node.rhs = resolve(rhs)
+
+        annotations = clone_query.annotations
+        if annotations:
+            subquery_keys = [
+                key for key, value in annotations.items()
+                if isinstance(value, Subquery)
+            ]
+            for key in subquery_keys:
+                annotations[key] = resolve(annotations[key])
+
+        clone_query.external_aliases.update(external_aliases)
         return clone
 
     def get_source_expressions(self):
-        return [
-            x for x in [
-                getattr(expr, 'lhs', None)
-                for expr in self.queryset.query.where.children
-            ] if x
-        ]
+        if self._source_expr_cache is None:
+            self._source_expr_cache = [
+                lhs for lhs in (
+                    getattr(expr, 'lhs', None)
+                    for expr in self.queryset.query.where.children
+                ) if lhs is not None
+            ]
+        return self._source_expr_cache
 
     def relabeled_clone(self, change_map):
         clone = self.copy()
-        clone.queryset.query = clone.queryset.query.relabeled_clone(change_map)
-        clone.queryset.query.external_aliases.update(
+        if not change_map:
+            return clone
+        # copy() has already cloned the query, so relabel it in place rather
+        # than cloning it a second time with query.relabeled_clone().
+        query = clone.queryset.query
+        query.change_aliases(change_map)
+        tables = query.tables
+        query.external_aliases.update(
             alias for alias in change_map.values()
-            if alias not in clone.queryset.query.tables
+            if alias not in tables
         )
         return clone
 
+    def _compile_subquery(self, connection):
+        # The (sql, params) for a given query and connection do not change once
+        # this expression has been resolved, and the same subquery is often
+        # compiled several times while building the outer query.
+        query = self.queryset.query
+        key = (id(query), connection.vendor, connection.alias)
+        cached = self._compiled_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        compiler_as_sql = query.get_compiler(connection=connection).as_sql
+        compiled = compiler_as_sql()
+        self._compiled_cache = (key, compiled)
+        return compiled
+
     def as_sql(self, compiler, connection, template=None, **extra_context):
         connection.ops.check_expression_support(self)
         template_params = self.extra.copy()
         template_params.update(extra_context)
-        template_params['subquery'], sql_params = self.queryset.query.get_compiler(connection=connection).as_sql()
+        template_params['subquery'], sql_params = self._compile_subquery(connection)
 
         template = template or template_params.get('template', self.template)
         sql = template % template_params
@@ -120,6 +178,7 @@ class Subquery(Expression):
 
 class Exists(Subquery):
     template = 'EXISTS(%(subquery)s)'
+    output_field = fields.BooleanField()
 
     def __init__(self, *args, **kwargs):
         self.negated = kwargs.pop('negated', False)
@@ -128,17 +187,23 @@ class Exists(Subquery):
     def __invert__(self):
         return type(self)(self.queryset, self.output_field, negated=(not self.negated), **self.extra)
 
-    @property
-    def output_field(self):
-        return fields.BooleanField()
-
     def resolve_expression(self, query=None, **kwargs):
+        clone = super(Exists, self).resolve_expression(query, **kwargs)
         # As a performance optimization, remove ordering since EXISTS doesn't
-        # care about it, just whether or not a row matches.
-        self.queryset = self.queryset.order_by()
-        return super(Exists, self).resolve_expression(query, **kwargs)
+        # care about it, just whether or not a row matches. The clone owns its
+        # query, so this can be done in place.
+        clone.queryset.query.clear_ordering(force_empty=True)
+        return clone
 
     def as_sql(self, compiler, connection, template=None, **extra_context):
+        if (template is None and self.template == Exists.template and
+                'template' not in extra_context and 'template' not in self.extra):
+            # The default template needs no formatting beyond the subquery
+            # itself, so skip building the template parameters.
+            connection.ops.check_expression_support(self)
+            sql, params = self._compile_subquery(connection)
+            sql = ('NOT EXISTS(%s)' if self.negated else 'EXISTS(%s)') % sql
+            return sql, params
         sql, params = super(Exists, self).as_sql(compiler, connection, template, **extra_context)
         if self.negated:
             sql = 'NOT {}'.format(sql)